@@ -0,0 +1,283 @@
+"""
+Provide asynchronous counterparts of the fasta and fastq readers.
+
+The readers in this module consume an asyncio.StreamReader, like the ones
+connected to subprocess pipes or sockets, and support iteration with
+async for. Data is pulled from the stream in large chunks and parsed by the
+same code used by the synchronous readers.
+
+AsyncFastqReader:
+Parse a fastq-formatted stream into sequenced read objects.
+
+AsyncFastaReader:
+Parse a fasta-formatted stream into (header, sequence) records.
+"""
+
+
+import codecs
+import re
+
+from operator import length_hint
+
+from .fasta import FastaReader, RECORD_SEP
+from .fastq import (
+    SimpleSeqRead, IncompleteRecordError,
+    _get_format_tokens, _parse_fastq_records
+    )
+
+
+# Text lines as split by universal newlines mode, i.e., ending in \r\n, \r
+# or \n. Unlike str.splitlines, this does not treat other characters, like
+# form feeds, as line boundaries. bytes.splitlines behaves like this anyway.
+_TEXT_LINE_RE = re.compile(r'[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+')
+
+
+def _split_lines (data):
+    """Split str or bytes data into lines keeping the line endings."""
+    if isinstance(data, str):
+        return _TEXT_LINE_RE.findall(data)
+    return data.splitlines(keepends=True)
+
+
+class _AsyncLineReader (object):
+    """Retrieve complete lines from an asyncio.StreamReader chunk by chunk.
+
+    The stream is only read from when a consumer asks for more data so the
+    amount of data buffered by a reader never exceeds a single chunk plus
+    whatever is needed to complete a record. Once the reader's buffer is
+    exhausted the asyncio flow control of the stream will, in turn, pause
+    the underlying transport, which propagates backpressure to the sender.
+    """
+
+    def __init__ (self, stream, chunk_size, encoding):
+        if chunk_size < 1:
+            raise ValueError('chunk_size needs to be a positive integer')
+        self.stream = stream
+        self.chunk_size = chunk_size
+        if encoding is None:
+            self._decoder = None
+        else:
+            self._decoder = codecs.getincrementaldecoder(encoding)()
+        # pieces of a partial line spread over several chunks
+        self._tail = []
+        self._eof = False
+
+    async def _read_lines (self):
+        """Return the complete lines found in the next chunk of the stream.
+
+        Lines are returned with their line endings. A partial line at the
+        end of a chunk is held back until it is completed by the next chunk
+        or the end of the stream is reached.
+        """
+        data = await self.stream.read(self.chunk_size)
+        if not data:
+            self._eof = True
+        if self._decoder is not None:
+            data = self._decoder.decode(data, final=self._eof)
+        lines = _split_lines(data)
+        if lines and not self._eof and lines[-1][-1:] not in ('\n', b'\n'):
+            partial = lines.pop()
+        else:
+            partial = None
+        if self._tail and (lines or self._eof):
+            # The first new line completes the partial line from previous
+            # chunks. Join the pieces only now to avoid copying a long line
+            # with every chunk, then split again in case the pieces contain
+            # a lone carriage return line ending.
+            lines[:1] = _split_lines(data[:0].join(self._tail + lines[:1]))
+            self._tail = []
+        if partial is not None:
+            self._tail.append(partial)
+        return lines
+
+
+class AsyncFastqReader (_AsyncLineReader):
+    """Parse an asynchronous stream in fastq format into read objects.
+
+    Works like FastqReader, but consumes an asyncio.StreamReader and is
+    iterated over with async for.
+    Yields read content as bytes or, if an encoding is specified, as text
+    strings.
+    """
+
+    def __init__ (self, stream, read_object=None,
+                  chunk_size=2**16, encoding=None):
+        """Initialize an AsyncFastqReader instance.
+
+        stream is the asyncio.StreamReader to consume.
+        read_object has the same meaning as for FastqReader.
+        chunk_size is the maximal number of bytes read from stream at once
+        and thereby controls how far the reader reads ahead of its consumer.
+        If an encoding is given, stream data is decoded with it and parsed
+        as text.
+        """
+        super().__init__(stream, chunk_size, encoding)
+        if read_object is None:
+            self._seqread = SimpleSeqRead()
+        else:
+            self._seqread = read_object
+        self._tokens = None
+        self._pending = []
+        # what the pending incomplete record still lacks
+        self._awaits_sep = False
+        self._qual_missing = 0
+        self._records = iter(())
+        self.is_bytes_source = None
+
+    def __aiter__ (self):
+        """Provide read object based iteration."""
+        return self
+
+    async def __anext__ (self):
+        for record in self._records:
+            self._seqread.read = record
+            return self._seqread
+        while not self._eof:
+            records = await self._read_records()
+            if records:
+                self._records = iter(records)
+                self._seqread.read = next(self._records)
+                return self._seqread
+        raise StopAsyncIteration
+
+    async def batches (self):
+        """Yield lists of (identifier, sequence, quality scores) tuples.
+
+        Each list holds all records completed by one chunk of stream data.
+        Use this instead of iterating over the reader itself to avoid the
+        per-record overhead of asynchronous iteration.
+        """
+        for record in self._records:
+            # hand out any records left over from previous iteration first
+            yield [record] + list(self._records)
+        while not self._eof:
+            records = await self._read_records()
+            if records:
+                yield records
+
+    async def _read_records (self):
+        """Parse all records completed by the next chunk of the stream."""
+        lines = await self._read_lines()
+        if self._pending:
+            if not (self._eof or self._may_complete_pending(lines)):
+                self._pending.extend(lines)
+                return []
+            lines = self._pending + lines
+            self._pending = []
+        if not lines:
+            return []
+        if self._tokens is None:
+            self._tokens = _get_format_tokens(lines[0])
+            self.is_bytes_source = isinstance(lines[0], bytes)
+        records = []
+        it = iter(lines)
+        done = 0
+        try:
+            for record in _parse_fastq_records(it, next(it), *self._tokens):
+                records.append(record)
+                done = len(lines) - length_hint(it)
+        except IncompleteRecordError:
+            if self._eof:
+                raise
+            # keep the lines of the incomplete record until the next chunk
+            # arrives
+            self._pending = lines[done:]
+            self._inspect_pending()
+        return records
+
+    def _inspect_pending (self):
+        """Determine what the incomplete pending record is still missing."""
+        sep_token = self._tokens[1]
+        it = iter(self._pending)
+        for line in it:
+            # skip empty lines before the title line
+            if line.rstrip():
+                break
+        seqlen = 0
+        for line in it:
+            if line[0] == sep_token:
+                break
+            seqlen += len(line.rstrip())
+        else:
+            self._awaits_sep = True
+            return
+        self._awaits_sep = False
+        self._qual_missing = seqlen - sum(len(line.rstrip()) for line in it)
+
+    def _may_complete_pending (self, lines):
+        """Check whether new lines can complete the pending record.
+
+        Used to avoid parsing the pending lines again with every chunk
+        when a record is spread over many chunks.
+        """
+        if self._awaits_sep:
+            sep_token = self._tokens[1]
+            return any(line[0] == sep_token for line in lines)
+        self._qual_missing -= sum(len(line.rstrip()) for line in lines)
+        return self._qual_missing <= 0
+
+
+class AsyncFastaReader (_AsyncLineReader):
+    """Parse an asynchronous stream in fasta format into records.
+
+    Consumes an asyncio.StreamReader and, when iterated over with async for,
+    yields (header, sequence) tuples like FastaReader.sequences().
+    Records are parsed by a synchronous fasta reader instance so any
+    validation done by it applies to the asynchronous reader, too.
+    Since records are yielded whole, every record is kept in memory until
+    its last line has been received.
+    """
+
+    def __init__ (self, stream, reader_class=FastaReader,
+                  chunk_size=2**16, encoding='ascii'):
+        """Initialize an AsyncFastaReader instance.
+
+        stream is the asyncio.StreamReader to consume.
+        reader_class is used to parse records and will be called with a
+        list of the lines of complete records. Use, e.g., FastaNucleotideReader
+        to get the sequence alphabet checked.
+        chunk_size is the maximal number of bytes read from stream at once.
+        encoding is used to decode the stream data into text and cannot be
+        None since fasta readers only parse text.
+        """
+        if encoding is None:
+            raise ValueError('AsyncFastaReader requires an encoding')
+        super().__init__(stream, chunk_size, encoding)
+        self.reader_class = reader_class
+        self._pending = []
+        self._records = iter(())
+
+    def __aiter__ (self):
+        return self
+
+    async def __anext__ (self):
+        for record in self._records:
+            return record
+        while not self._eof:
+            records = await self._read_records()
+            if records:
+                self._records = iter(records)
+                return next(self._records)
+        raise StopAsyncIteration
+
+    async def _read_records (self):
+        """Parse all records completed by the next chunk of the stream."""
+        lines = await self._read_lines()
+        if self._eof:
+            complete, self._pending = self._pending + lines, []
+        else:
+            # A record is complete only once the next header line has been
+            # seen. Look for the last header in the new lines only since
+            # pending lines never contain a header except as their first
+            # element.
+            for i in range(len(lines) - 1, -1, -1):
+                if lines[i][:1] == RECORD_SEP:
+                    complete = self._pending + lines[:i]
+                    self._pending = lines[i:]
+                    break
+            else:
+                self._pending.extend(lines)
+                return []
+        if not complete:
+            return []
+        return list(self.reader_class(complete).sequences())
@@ -138,6 +138,7 @@ class FastaReader (object):
         
         sep_len = len(separator)
         header_tail = None
+        is_header = False
         for is_header, item in groupby(
             iterable, lambda line: line[:sep_len] == separator
             ):
@@ -148,6 +149,10 @@ class FastaReader (object):
                 header_tail = header_tails[-1]
             else:
                 yield (header_tail, item)
+        if is_header:
+            # the input ended with a header line => the last record
+            # has no content
+            yield (header_tail, iter([]))
 
 
 class FastaWithAlphabetReader (FastaReader):
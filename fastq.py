@@ -19,6 +19,11 @@ Parse a stream in fastq-format into sequenced read objects.
 from . import seqtransform, seqreads
 
 
+class IncompleteRecordError (ValueError):
+    """Raised when the input ends in the middle of a fastq record."""
+    pass
+
+
 class SimpleSeqRead (seqreads.SeqReadFacade):
     def __init__ (self, read_object=None, is_dna=True):
         if read_object is None:
@@ -151,73 +156,88 @@ class FastqReader (object):
             # elements.
             self.is_bytes_source = None
             return
-        if isinstance(title, bytes):
-            title_token = ord('@')
-            sep_token = ord('+')
-            glue = b''
-            self.is_bytes_source = True
-        elif isinstance(title, str):
-            title_token = '@'
-            sep_token = '+'
-            glue = ''
-            self.is_bytes_source = False
-        else:
-            raise TypeError(
-                'An iterator over bytes or str elements is required. '
-                'Found element of type {0}.'
-                .format(type(title).__name__)
-                )
+        title_token, sep_token, glue = _get_format_tokens(title)
+        self.is_bytes_source = isinstance(title, bytes)
         # With the source format figured out, pause here to give the
         # instance a chance to finish configuring itself.
         yield None
 
-        while True:
-            if not title[0] == title_token:
-                # allow empty lines between records
-                if not title.rstrip(): continue
+        yield from _parse_fastq_records(
+            self.src, title, title_token, sep_token, glue
+            )
+
+
+def _get_format_tokens (line):
+    """Return the title and separator tokens and the glue for line's type."""
+    if isinstance(line, bytes):
+        return ord('@'), ord('+'), b''
+    if isinstance(line, str):
+        return '@', '+', ''
+    raise TypeError(
+        'An iterator over bytes or str elements is required. '
+        'Found element of type {0}.'
+        .format(type(line).__name__)
+        )
+
+
+def _parse_fastq_records (src, title, title_token, sep_token, glue):
+    """Parse fastq records from the lines of iterator src.
+
+    title is the first line of the input, which has already been retrieved
+    from src. See FastqReader._read_fastq_records for the format details.
+    """
+    while True:
+        if not title[0] == title_token:
+            # allow empty lines between records
+            if not title.rstrip():
+                try:
+                    title = next(src)
+                except StopIteration:
+                    return
+                continue
+            raise ValueError(
+                'Invalid format: Title line not starting with @',
+                title
+                )
+        title = title[1:].rstrip()
+        line_tmp = []
+        try:
+            # from here on any StopIteration means an incomplete record
+            while True:
+                currentLine = next(src)
+                # we are accepting arbitrary numbers of empty lines anywhere
+                if currentLine[0] == sep_token: break
+                line_tmp.append(currentLine.rstrip())
+            seq = glue.join(line_tmp)
+            seqlen = len(seq)
+            if seqlen == 0:
                 raise ValueError(
-                    'Invalid format: Title line not starting with @',
+                    'Invalid format: Record without sequence',
                     title
                     )
-            title = title[1:].rstrip()
+            quallen = 0
             line_tmp = []
-            try:
-                # from here on any StopIteration means an incomplete record
-                while True:
-                    currentLine = next(self.src)
-                    # we are accepting arbitrary numbers of empty lines anywhere
-                    if currentLine[0] == sep_token: break
-                    line_tmp.append(currentLine.rstrip())
-                seq = glue.join(line_tmp)
-                seqlen = len(seq)
-                if seqlen == 0:
-                    raise ValueError(
-                        'Invalid format: Record without sequence',
-                        title
-                        )
-                quallen = 0
-                line_tmp = []
-                while seqlen > quallen:
-                    currentLine = next(self.src).rstrip()
-                    # again we are accepting any number of empty lines
-                    line_tmp.append(currentLine)
-                    quallen += len(currentLine)
-            except StopIteration:
-                raise ValueError(
-                    'Invalid format: Last record is incomplete',
-                    title
-                    ) from None
-            if seqlen < quallen:
-                raise ValueError(
-                    'Invalid format: Record with inconsistent lengths of '
-                    'sequence and quality score',
-                    title
-                    )
-            qual = glue.join(line_tmp)
-            yield title, seq, qual
-
-            try:
-                title = next(self.src)
-            except StopIteration:
-                # no more records to parse
-                return
+            while seqlen > quallen:
+                currentLine = next(src).rstrip()
+                # again we are accepting any number of empty lines
+                line_tmp.append(currentLine)
+                quallen += len(currentLine)
+        except StopIteration:
+            raise IncompleteRecordError(
+                'Invalid format: Last record is incomplete',
+                title
+                ) from None
+        if seqlen < quallen:
+            raise ValueError(
+                'Invalid format: Record with inconsistent lengths of '
+                'sequence and quality score',
+                title
+                )
+        qual = glue.join(line_tmp)
+        yield title, seq, qual
+
+        try:
+            title = next(src)
+        except StopIteration:
+            # no more records to parse
+            return
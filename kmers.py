@@ -0,0 +1,430 @@
+"""
+Provide streaming k-mer counting over nucleotide sequences.
+
+K-mers of up to 31 bases are encoded as integers using two bits per base
+(A=0, C=1, G=2, T/U=3) so that every k-mer fits into an unsigned 64-bit
+value. Encodings are updated incrementally while moving along a sequence and
+any base that is not one of the four unambiguous nucleotides (N or another
+IUPAC ambiguity code) breaks the run of overlapping k-mers.
+
+iter_kmers:
+Yield the integer encodings of all k-mers in a sequence.
+
+KmerCounter:
+Count k-mers from sequences, fasta records or sequenced reads into a compact
+array-backed hash table that can be sharded and merged.
+"""
+
+
+from array import array
+from collections import Counter
+
+from . import seqtransform
+
+
+MAX_K = 31
+
+_BREAK = 4
+_BREAK_BYTE = bytes([_BREAK])
+_EMPTY = 2**64 - 1
+_M64 = 2**64 - 1
+_MAX_LOAD = 0.7
+# maximal number of distinct k-mers tallied before updating the table
+_TALLY_FLUSH_SIZE = 2**20
+# number of bases of short sequences to join for k-mer extraction
+_JOIN_SIZE = 2**16
+
+
+def _make_code_tables (is_dna):
+    """Return translation tables mapping bytes to base codes.
+
+    The first table maps each nucleotide byte to its 2-bit code, the second
+    maps it to the code of its complement as defined by the seqtransform
+    translation tables. All other bytes are mapped to _BREAK.
+    """
+    if is_dna:
+        alphabet = 'ACGT'
+        translation_table = seqtransform.DNA_TRANSLATION_TABLE
+    else:
+        alphabet = 'ACGU'
+        translation_table = seqtransform.RNA_TRANSLATION_TABLE
+    codes = bytearray([_BREAK]) * 256
+    for code, base in enumerate(alphabet):
+        codes[ord(base)] = codes[ord(base.lower())] = code
+    codes = bytes(codes)
+    return codes, translation_table.translate(codes)
+
+
+_CODE_TABLES = {
+    True: _make_code_tables(is_dna=True),
+    False: _make_code_tables(is_dna=False)
+    }
+
+
+_GOLDEN = 0x9E3779B97F4A7C15
+
+
+def _hash64 (x):
+    """Scramble the bits of a 64-bit k-mer code (Fibonacci hashing).
+
+    The high bits of the result are well mixed and are used to select hash
+    table slots; bits 32 and up select shards.
+    """
+    return (x * _GOLDEN) & _M64
+
+
+def _check_k (k):
+    if not 0 < k <= MAX_K:
+        raise ValueError(
+            'k-mer length must be between 1 and {0}, got {1}.'
+            .format(MAX_K, k)
+            )
+
+
+def _as_chunks (seq):
+    """Turn a sequence or an iterable of sequence chunks into bytes chunks."""
+    if isinstance(seq, (str, bytes, bytearray, memoryview)):
+        seq = (seq,)
+    for chunk in seq:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('latin-1', 'replace')
+        elif isinstance(chunk, memoryview):
+            chunk = bytes(chunk)
+        yield chunk
+
+
+def encode_kmer (kmer, is_dna=True):
+    """Return the integer encoding of a k-mer given as str or bytes."""
+    _check_k(len(kmer))
+    codes = _CODE_TABLES[is_dna][0]
+    code = 0
+    for chunk in _as_chunks(kmer):
+        for c in chunk.translate(codes):
+            if c == _BREAK:
+                raise ValueError(
+                    'Cannot encode k-mer with ambiguous bases: {0}'
+                    .format(kmer)
+                    )
+            code = (code << 2) | c
+    return code
+
+
+def decode_kmer (code, k, is_dna=True):
+    """Return the k-mer sequence, as str, encoded by the integer code."""
+    alphabet = 'ACGT' if is_dna else 'ACGU'
+    return ''.join(
+        alphabet[(code >> shift) & 3] for shift in range(2 * (k - 1), -1, -2)
+        )
+
+
+def reverse_complement_code (code, k):
+    """Return the encoding of the reverse complement of an encoded k-mer."""
+    rc = 0
+    for _ in range(k):
+        rc = (rc << 2) | (3 - (code & 3))
+        code >>= 2
+    return rc
+
+
+def canonical_code (code, k):
+    """Return the smaller of a k-mer encoding and its reverse complement's."""
+    return min(code, reverse_complement_code(code, k))
+
+
+def iter_kmers (seq, k, canonical=False, is_dna=True):
+    """Yield the integer encodings of all k-mers in seq.
+
+    seq can be a str or bytes sequence or an iterable of such chunks (like
+    the sequence line iterators generated by a FastaReader), in which case
+    k-mers spanning chunk boundaries are reported as if the chunks had been
+    joined.
+    Any character that is not an unambiguous nucleotide resets the k-mer
+    window, i.e., no k-mer containing it is generated.
+    With canonical=True, the smaller of the encodings of each k-mer and its
+    reverse complement is yielded instead of the forward encoding.
+    """
+    _check_k(k)
+    codes, complement_codes = _CODE_TABLES[is_dna]
+    mask = (1 << 2 * k) - 1
+    shift = 2 * (k - 1)
+    # fwd and rev hold the encodings of the last up to k bases seen and
+    # valid counts these bases up to a maximum of k - 1.
+    fwd = rev = valid = 0
+    for chunk in _as_chunks(seq):
+        # Split at ambiguous bases in C so that the loops below do not have
+        # to check every base.
+        fwd_segments = chunk.translate(codes).split(_BREAK_BYTE)
+        if canonical:
+            rev_segments = chunk.translate(complement_codes).split(
+                _BREAK_BYTE
+                )
+        else:
+            rev_segments = fwd_segments
+        for n, (fwd_codes, rev_codes) in enumerate(
+            zip(fwd_segments, rev_segments)
+            ):
+            if n:
+                # we have crossed an ambiguous base
+                valid = 0
+            if valid < k - 1:
+                # not enough bases for a first k-mer yet
+                warmup = k - 1 - valid
+                for c, rc in zip(fwd_codes[:warmup], rev_codes[:warmup]):
+                    fwd = (fwd << 2) | c
+                    rev = (rev >> 2) | (rc << shift)
+                if len(fwd_codes) < warmup:
+                    valid += len(fwd_codes)
+                    continue
+                valid = k - 1
+                fwd_codes = fwd_codes[warmup:]
+                rev_codes = rev_codes[warmup:]
+            if canonical:
+                for c, rc in zip(fwd_codes, rev_codes):
+                    fwd = ((fwd << 2) | c) & mask
+                    rev = (rev >> 2) | (rc << shift)
+                    yield rev if rev < fwd else fwd
+            else:
+                for c in fwd_codes:
+                    fwd = ((fwd << 2) | c) & mask
+                    yield fwd
+
+
+class KmerCounter (object):
+    """Count k-mers in an open-addressing hash table backed by two arrays.
+
+    Keys and counts are stored as unsigned 64-bit integers in parallel
+    arrays, which takes a fraction of the memory a dict of Python ints
+    would need and makes instances cheap to pickle for transfer between
+    processes.
+
+    To distribute counting over several processes, give each process its
+    own instance with the same nshards and a different shard number and let
+    every process consume the full input. Each instance will only count the
+    k-mers falling into its shard, so the partial results are disjoint and
+    can be combined cheaply with merge().
+    Alternatively, the input can be split between processes and the
+    overlapping partial counts be merged in the same way.
+    """
+
+    def __init__ (self, k, canonical=False, is_dna=True,
+                  shard=0, nshards=1, capacity=1024):
+        """Initialize an empty KmerCounter instance.
+
+        k is the k-mer length and may not exceed MAX_K.
+        If canonical is True, each k-mer is counted together with its
+        reverse complement under the smaller of their two encodings.
+        is_dna selects between T (the default) and U as the fourth base.
+        shard and nshards restrict counting of k-mers from added sequences
+        to one of nshards disjoint partitions of k-mer space.
+        capacity is the initial number of hash table slots (rounded up to a
+        power of two); the table grows automatically as needed.
+        """
+        _check_k(k)
+        if not 0 <= shard < nshards:
+            raise ValueError(
+                'shard must be between 0 and {0}, got {1}.'
+                .format(nshards - 1, shard)
+                )
+        self.k = k
+        self.canonical = canonical
+        self.is_dna = is_dna
+        self.shard = shard
+        self.nshards = nshards
+        size = 1
+        while size < capacity:
+            size <<= 1
+        self._allocate(size)
+
+    def _allocate (self, size):
+        self._keys = array('Q', [_EMPTY]) * size
+        self._counts = array('Q', [0]) * size
+        self._mask = size - 1
+        self._shift = 64 - size.bit_length() + 1
+        self._max_used = int(size * _MAX_LOAD)
+        self._used = 0
+
+    def _grow (self, size=None):
+        """Rehash the table into one with size slots, twice as many by default."""
+        old_keys, old_counts = self._keys, self._counts
+        self._allocate(size or 2 * len(old_keys))
+        self._add_counts(
+            (key, count) for key, count in zip(old_keys, old_counts)
+            if key != _EMPTY
+            )
+
+    def _reserve (self, n):
+        """Grow the table once to accommodate n additional keys.
+
+        This avoids rehashing the table repeatedly while adding many keys.
+        """
+        needed = self._used + n
+        size = len(self._keys)
+        while int(size * _MAX_LOAD) < needed:
+            size <<= 1
+        if size > len(self._keys):
+            self._grow(size)
+
+    def _find_slot (self, key):
+        keys = self._keys
+        mask = self._mask
+        i = _hash64(key) >> self._shift
+        while True:
+            slot_key = keys[i]
+            if slot_key == key or slot_key == _EMPTY:
+                return i
+            i = (i + 1) & mask
+
+    def _add_counts (self, key_counts, apply_shard=False):
+        """Add counts from an iterable of (key, count) pairs to the table.
+
+        If apply_shard is True, keys not falling into our shard are skipped.
+        """
+        nshards = self.nshards if apply_shard else 1
+        shard = self.shard
+        # local copies of the table; refreshed whenever the table grows
+        table_keys, counts = self._keys, self._counts
+        mask, shift = self._mask, self._shift
+        for key, count in key_counts:
+            h = (key * _GOLDEN) & _M64  # inlined _hash64
+            if nshards > 1 and (h >> 32) % nshards != shard:
+                continue
+            i = h >> shift
+            while True:
+                slot_key = table_keys[i]
+                if slot_key == key:
+                    counts[i] += count
+                    break
+                if slot_key == _EMPTY:
+                    table_keys[i] = key
+                    counts[i] = count
+                    self._used += 1
+                    if self._used > self._max_used:
+                        self._grow()
+                        table_keys, counts = self._keys, self._counts
+                        mask, shift = self._mask, self._shift
+                    break
+                i = (i + 1) & mask
+
+    def _count_sequences (self, seqs):
+        """Count the k-mers in every sequence from iterable seqs.
+
+        K-mers are tallied in a collections.Counter first, which does the
+        per-k-mer counting in C, so only distinct k-mers have to be hashed
+        into the table. The tally is flushed to the table whenever it grows
+        large to keep memory use bounded.
+        Short sequences, like reads, are joined with an ambiguous base
+        between them and processed together to save per-sequence overhead.
+        """
+        tally = Counter()
+        joinable = []
+        joinable_len = 0
+        for seq in seqs:
+            if isinstance(seq, (str, bytes, bytearray, memoryview)):
+                joinable.append(seq)
+                joinable_len += len(seq)
+                if joinable_len < _JOIN_SIZE:
+                    continue
+                seq = b'N'.join(_as_chunks(joinable))
+                joinable = []
+                joinable_len = 0
+            tally.update(
+                iter_kmers(seq, self.k, self.canonical, self.is_dna)
+                )
+            if len(tally) >= _TALLY_FLUSH_SIZE:
+                self._flush_tally(tally)
+                tally.clear()
+        if joinable:
+            tally.update(
+                iter_kmers(
+                    b'N'.join(_as_chunks(joinable)),
+                    self.k, self.canonical, self.is_dna
+                    )
+                )
+        self._flush_tally(tally)
+
+    def _flush_tally (self, tally):
+        self._reserve(len(tally) // self.nshards)
+        self._add_counts(tally.items(), apply_shard=True)
+
+    def _lookup_code (self, kmer):
+        if isinstance(kmer, int):
+            code = kmer
+        else:
+            if len(kmer) != self.k:
+                raise ValueError(
+                    'Expected a k-mer of length {0}, got "{1}".'
+                    .format(self.k, kmer)
+                    )
+            code = encode_kmer(kmer, self.is_dna)
+        if self.canonical:
+            code = canonical_code(code, self.k)
+        return code
+
+    def add_sequence (self, seq):
+        """Count the k-mers in a single sequence.
+
+        seq can be given as a str or bytes object or as an iterable of
+        consecutive chunks of one sequence.
+        """
+        self._count_sequences((seq,))
+
+    def add_sequences (self, seqs):
+        """Count the k-mers in every sequence from iterable seqs."""
+        self._count_sequences(seqs)
+
+    def add_fasta (self, reader):
+        """Count the k-mers in all records of a FastaReader.
+
+        Sequence lines are consumed as they get parsed so that even very
+        long records never get held in memory in their entirety.
+        """
+        self._count_sequences(seq_iter for header, seq_iter in reader)
+
+    def add_reads (self, reads):
+        """Count the k-mers in the sequences of SeqReadFacade objects.
+
+        Works with anything providing a sequence attribute, like the read
+        objects generated by FastqReader.
+        """
+        self._count_sequences(read.sequence for read in reads)
+
+    def merge (self, other):
+        """Add the counts from another KmerCounter to this instance.
+
+        Both instances need to agree on k, canonical and is_dna. Shard
+        settings only apply to sequences being added and are ignored here.
+        """
+        if (other.k, other.canonical, other.is_dna) != (
+            self.k, self.canonical, self.is_dna
+            ):
+            raise ValueError(
+                'Cannot merge counts of k-mers encoded differently.'
+                )
+        self._reserve(len(other))
+        self._add_counts(other.items())
+        return self
+
+    def items (self):
+        """Yield (k-mer encoding, count) tuples in arbitrary order."""
+        for key, count in zip(self._keys, self._counts):
+            if key != _EMPTY:
+                yield key, count
+
+    def kmers (self):
+        """Yield (k-mer, count) tuples with k-mers decoded to str."""
+        for key, count in self.items():
+            yield decode_kmer(key, self.k, self.is_dna), count
+
+    def __getitem__ (self, kmer):
+        """Return the count of kmer given as str, bytes or integer code."""
+        code = self._lookup_code(kmer)
+        i = self._find_slot(code)
+        if self._keys[i] == _EMPTY:
+            return 0
+        return self._counts[i]
+
+    def __contains__ (self, kmer):
+        return self[kmer] > 0
+
+    def __len__ (self):
+        return self._used
@@ -1,5 +1,9 @@
 import pysam
 
+from array import array
+from itertools import groupby, islice
+from operator import attrgetter, itemgetter
+
 from . import seqtransform
 
 from .seqreads import SeqReadFacade
@@ -78,3 +82,120 @@ class PysamRead (SeqReadFacade):
             seqtransform.complement(self.read.seq, is_dna=self.is_dna),
             self.read.qual[::-1]
             )
+
+
+_get_core_fields = attrgetter('qname', 'flag')
+_get_seq = attrgetter('seq')
+_get_qual = attrgetter('qual')
+
+
+def _get_rg_id (read):
+    if read.has_tag('RG'):
+        return read.get_tag('RG')
+    return None
+
+
+class ReadBatch (object):
+    """Store the fields of a batch of pysam reads in columns.
+
+    All read fields needed for grouping reads are retrieved from the pysam
+    read objects once when the batch is built and are then accessible as
+    parallel sequences:
+    reads: the original pysam read objects
+    qnames: list of read names
+    rg_ids: list of read group ids, None for reads without an RG tag
+    flags: array of read flags
+    The seqs and quals columns of read sequences and quality scores are
+    only retrieved when first accessed.
+    """
+
+    def __init__ (self, reads):
+        self.reads = reads
+        self.qnames, flags = (
+            list(zip(*map(_get_core_fields, reads))) or ((), ())
+            )
+        self.flags = array('H', flags)
+        self.rg_ids = list(map(_get_rg_id, reads))
+        self._seqs = None
+        self._quals = None
+
+    @property
+    def seqs (self):
+        if self._seqs is None:
+            self._seqs = list(map(_get_seq, self.reads))
+        return self._seqs
+
+    @property
+    def quals (self):
+        if self._quals is None:
+            self._quals = list(map(_get_qual, self.reads))
+        return self._quals
+
+    def primary_mask (self):
+        """Return a list of booleans indicating primary alignments."""
+        return [not flag & 0x900 for flag in self.flags]
+
+    def __len__ (self):
+        return len(self.reads)
+
+
+class ReadBatchReader (object):
+    """Retrieve reads from an iterable of pysam reads in ReadBatch chunks.
+
+    Use as src of group_batches_by_qname to group the reads from a
+    pysam.AlignmentFile without handling the reads one by one.
+    """
+
+    def __init__ (self, src, batch_size=4096):
+        """Initialize a ReadBatchReader instance.
+
+        src is the iterable of pysam reads to consume, e.g., an open
+        pysam.AlignmentFile.
+        batch_size is the maximal number of reads per ReadBatch.
+        """
+        if batch_size < 1:
+            raise ValueError('batch_size needs to be a positive integer')
+        self.src = iter(src)
+        self.batch_size = batch_size
+
+    def __iter__ (self):
+        while True:
+            reads = list(islice(self.src, self.batch_size))
+            if not reads:
+                return
+            yield ReadBatch(reads)
+
+
+def group_batches_by_qname (src, read_class=PysamRead):
+    """
+    Yield primary reads from ReadBatch iterable src grouped by read group
+    and identifier.
+
+    Works like seqreads.group_reads_by_qname, but consumes reads in
+    ReadBatch chunks and yields the same (read group, [read, ...]) tuples
+    with every read wrapped in read_class.
+    Groups extending across batch boundaries are joined before they are
+    yielded.
+    """
+    group_key = None
+    group_reads = []
+    for batch in src:
+        for key, run in groupby(
+            zip(
+                zip(batch.qnames, batch.rg_ids),
+                batch.primary_mask(),
+                batch.reads
+                ),
+            itemgetter(0)
+            ):
+            primary_reads = [
+                read_class(read) for _, is_primary, read in run if is_primary
+                ]
+            if key == group_key:
+                group_reads.extend(primary_reads)
+                continue
+            if group_reads:
+                yield (group_key[1], group_reads)
+            group_key, group_reads = key, primary_reads
+    if group_reads:
+        yield (group_key[1], group_reads)
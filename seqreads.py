@@ -98,7 +98,7 @@ class ReadSplitter (object):
     sanity checks for read to read group associations.
     """
     
-    def __init__ (self, src, header=None, default_rg=None):
+    def __init__ (self, src, header=None, default_rg=None, grouper=None):
         """Initialize a ReadSplitter instance.
 
         src is the iterable to retrieve reads from.
@@ -115,6 +115,10 @@ class ReadSplitter (object):
         read group for all reads that do not declare their read group
         explicitly. This default_rg will be substituted for missing read
         groups before any read group sanity checks.
+        grouper is the function used to group the reads from src and
+        defaults to group_reads_by_qname. Pass
+        pysaminter.group_batches_by_qname together with a
+        pysaminter.ReadBatchReader as src for faster grouping of pysam reads.
         """
         if header and 'RG' not in header:
             raise ValueError('header needs to provide a "RG" key')
@@ -130,12 +134,13 @@ class ReadSplitter (object):
         self.src = iter(src)
         self.header = header
         self.default_rg = default_rg
+        self.grouper = grouper or group_reads_by_qname
 
     def __iter__ (self):
         """
-        Wrap group_reads_by_qname to provide iteration with read group checks.
+        Wrap self.grouper to provide iteration with read group checks.
         """
-        it = group_reads_by_qname(self.src)
+        it = self.grouper(self.src)
         try:
             rg_id, grouped_reads = next(it)
         except StopIteration:
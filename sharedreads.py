@@ -0,0 +1,440 @@
+"""
+Provide transport of sequenced reads between processes via shared memory.
+
+Instead of pickling every read sent to another process, batches of reads
+are packed into the slots of a ring buffer in shared memory and consumers
+access their contents through memoryviews without copying.
+
+ReadBatchRing:
+A ring buffer of read batch slots shared between producer and consumer
+processes.
+
+SharedReadBatch:
+A consumer's zero-copy view of one batch of reads in a ReadBatchRing.
+
+SharedSeqRead:
+A facade providing SimpleSeqRead-compatible access to a read in a
+SharedReadBatch.
+"""
+
+
+import multiprocessing
+import queue
+import struct
+
+from array import array
+from itertools import accumulate, chain
+from multiprocessing import shared_memory
+
+from .fastq import SimpleSeqRead
+from .seqreads import SeqReadFacade
+
+
+# global ring header: end of input flag, next batch sequence number
+_RING_HEADER = struct.Struct('<QQ')
+# per-slot header: state, number of reads, batch sequence number
+_SLOT_HEADER = struct.Struct('<BxxxIQ')
+
+_FREE = 0
+_WRITING = 1
+_FILLED = 2
+_READING = 3
+
+
+def _to_bytes (s):
+    if isinstance(s, str):
+        return s.encode('ascii')
+    return s
+
+
+def _as_record (read):
+    """Return a (title, sequence, quality) tuple of bytes.
+
+    read can be such a tuple with bytes or str fields or a SeqReadFacade
+    object. The contents of the latter get copied since read objects, like
+    the one generated by FastqReader, may be reused for the next read.
+    """
+    if isinstance(read, SeqReadFacade):
+        read = read.read_data
+    if len(read) != 3:
+        raise ValueError(
+            'Expected (title, sequence, quality) records, '
+            'found record with {0} fields.'
+            .format(len(read))
+            )
+    title, seq, qual = read
+    return _to_bytes(title), _to_bytes(seq), _to_bytes(qual)
+
+
+class ReadBatchRing (object):
+    """Pass batches of reads between processes through shared memory.
+
+    The ring consists of nslots slots of slot_size bytes each. A producer
+    packs batches of (title, sequence, quality) records into free slots with
+    put() or feed() and consumers obtain them as SharedReadBatch objects
+    from get() or through iteration. A consumer has to release() every batch
+    it is done with to make its slot available to producers again.
+    A producer blocks when all slots are in use, which throttles it to the
+    speed of its consumers.
+
+    Instances can be passed to processes started from the creating process
+    as arguments, which attaches them to the same shared memory block.
+    The creating process owns the shared memory and is responsible for
+    calling unlink() (or using the instance as a context manager) once the
+    ring is not needed anymore.
+    """
+
+    def __init__ (self, nslots=8, slot_size=2**22, ctx=None):
+        """Initialize a ReadBatchRing instance and its shared memory.
+
+        nslots is the number of batches that can be in flight at any time.
+        slot_size is the number of bytes available for each batch, which
+        has to accommodate, per read, the title, sequence and quality bytes
+        plus 12 bytes of offsets.
+        ctx is the multiprocessing context used to create the
+        synchronization primitives; the default context is used if None.
+        """
+        if nslots < 1:
+            raise ValueError('nslots needs to be a positive integer')
+        # keep slots 8-byte aligned and offsets addressable as uint32
+        slot_size -= slot_size % 8
+        if not _SLOT_HEADER.size + 16 <= slot_size < 2**32:
+            raise ValueError(
+                'slot_size needs to be between {0} and {1} bytes.'
+                .format(_SLOT_HEADER.size + 16, 2**32 - 1)
+                )
+        if ctx is None:
+            ctx = multiprocessing.get_context()
+        self.nslots = nslots
+        self.slot_size = slot_size
+        self._shm = shared_memory.SharedMemory(
+            create=True, size=_RING_HEADER.size + nslots * slot_size
+            )
+        self._owner = True
+        _RING_HEADER.pack_into(self._shm.buf, 0, 0, 0)
+        for slot in range(nslots):
+            _SLOT_HEADER.pack_into(
+                self._shm.buf, self._slot_start(slot), _FREE, 0, 0
+                )
+        self._lock = ctx.Lock()
+        self._free = ctx.Semaphore(nslots)
+        self._filled = ctx.Semaphore(0)
+
+    def __getstate__ (self):
+        return {
+            'name': self._shm.name,
+            'nslots': self.nslots,
+            'slot_size': self.slot_size,
+            'lock': self._lock,
+            'free': self._free,
+            'filled': self._filled
+            }
+
+    def __setstate__ (self, state):
+        self.nslots = state['nslots']
+        self.slot_size = state['slot_size']
+        self._shm = shared_memory.SharedMemory(name=state['name'])
+        self._owner = False
+        self._lock = state['lock']
+        self._free = state['free']
+        self._filled = state['filled']
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, *exc_info):
+        try:
+            self.close()
+        finally:
+            if self._owner:
+                self.unlink()
+
+    @property
+    def name (self):
+        return self._shm.name
+
+    def _slot_start (self, slot):
+        return _RING_HEADER.size + slot * self.slot_size
+
+    def _set_slot_state (self, slot, state):
+        self._shm.buf[self._slot_start(slot)] = state
+
+    def _find_slot (self, state):
+        """Return the oldest slot in the given state or None.
+
+        Must be called with the lock held.
+        """
+        buf = self._shm.buf
+        found, found_seqno = None, None
+        for slot in range(self.nslots):
+            slot_state, count, seqno = _SLOT_HEADER.unpack_from(
+                buf, self._slot_start(slot)
+                )
+            if slot_state == state and (found is None or seqno < found_seqno):
+                found, found_seqno = slot, seqno
+        return found
+
+    def _pack (self, records):
+        """Return the offsets array and data bytes for a batch of records."""
+        parts = list(chain.from_iterable(map(_as_record, records)))
+        offsets = array('I', accumulate(chain((0,), map(len, parts))))
+        data = b''.join(parts)
+        return offsets, data
+
+    def _batch_size (self, noffsets, data_len):
+        return _SLOT_HEADER.size + 4 * noffsets + data_len
+
+    def put (self, records, block=True, timeout=None):
+        """Write a batch of records to a free slot.
+
+        records can be (title, sequence, quality) tuples or SeqReadFacade
+        objects, like the reads generated by a FastqReader. Fields can be
+        bytes or ASCII str objects, but will always be handed to consumers
+        as bytes.
+        Blocks until a slot becomes free unless block is False, in which
+        case queue.Full is raised immediately if no slot is free. With block
+        True, queue.Full is raised if no slot becomes free within timeout
+        seconds.
+        Raises ValueError if mark_done() has been called before.
+        """
+        offsets, data = self._pack(records)
+        needed = self._batch_size(len(offsets), len(data))
+        if needed > self.slot_size:
+            raise ValueError(
+                'Batch of {0} bytes exceeds slot size of {1} bytes.'
+                .format(needed, self.slot_size)
+                )
+        if not self._free.acquire(block, timeout):
+            raise queue.Full
+        with self._lock:
+            if self._is_done():
+                slot = None
+            else:
+                slot = self._find_slot(_FREE)
+                self._set_slot_state(slot, _WRITING)
+        if slot is None:
+            self._free.release()
+            raise ValueError('Cannot put batches after mark_done().')
+        # the slot is reserved for us so we can fill it without the lock
+        buf = self._shm.buf
+        offsets_start = self._slot_start(slot) + _SLOT_HEADER.size
+        data_start = offsets_start + 4 * len(offsets)
+        buf[offsets_start:data_start] = offsets.tobytes()
+        buf[data_start:data_start + len(data)] = data
+        with self._lock:
+            closed, seqno = _RING_HEADER.unpack_from(buf, 0)
+            _RING_HEADER.pack_into(buf, 0, closed, seqno + 1)
+            _SLOT_HEADER.pack_into(
+                buf, self._slot_start(slot),
+                _FILLED, len(offsets) // 3, seqno
+                )
+        self._filled.release()
+
+    def feed (self, records, max_reads=None):
+        """Write all records from an iterable to slots in batches.
+
+        records can be anything accepted by put(), e.g., a FastqReader.
+        Packs as many consecutive records into each slot as fit into it or,
+        if max_reads is given, at most max_reads records.
+        Use mark_done() afterwards if no more records are going to follow.
+        """
+        capacity = self.slot_size - _SLOT_HEADER.size - 4
+        batch = []
+        batch_bytes = 0
+        for record in map(_as_record, records):
+            record_bytes = 12 + sum(map(len, record))
+            if batch and (
+                batch_bytes + record_bytes > capacity
+                or len(batch) == max_reads
+                ):
+                self.put(batch)
+                batch = []
+                batch_bytes = 0
+            batch.append(record)
+            batch_bytes += record_bytes
+        if batch:
+            self.put(batch)
+
+    def _is_done (self):
+        return _RING_HEADER.unpack_from(self._shm.buf, 0)[0] != 0
+
+    def mark_done (self):
+        """Signal to consumers that no more batches are going to be put.
+
+        Calling this method more than once has no further effect.
+        """
+        with self._lock:
+            closed, seqno = _RING_HEADER.unpack_from(self._shm.buf, 0)
+            if closed:
+                return
+            _RING_HEADER.pack_into(self._shm.buf, 0, 1, seqno)
+        self._filled.release()
+
+    def get (self, block=True, timeout=None):
+        """Return the oldest batch not yet handed to a consumer.
+
+        Returns None if the producer has called mark_done() and all batches
+        have been handed out.
+        Blocks until a batch becomes available unless block is False, in
+        which case queue.Empty is raised immediately if there is no batch.
+        With block True, queue.Empty is raised if no batch becomes available
+        within timeout seconds.
+        """
+        if not self._filled.acquire(block, timeout):
+            raise queue.Empty
+        with self._lock:
+            slot = self._find_slot(_FILLED)
+            if slot is None:
+                # We got woken up by mark_done().
+                # Pass the signal on to the next consumer.
+                self._filled.release()
+                return None
+            self._set_slot_state(slot, _READING)
+        state, count, seqno = _SLOT_HEADER.unpack_from(
+            self._shm.buf, self._slot_start(slot)
+            )
+        return SharedReadBatch(self, slot, count)
+
+    def __iter__ (self):
+        """Yield batches until the producer has signalled the end of input."""
+        while True:
+            batch = self.get()
+            if batch is None:
+                return
+            yield batch
+
+    def _release (self, slot):
+        with self._lock:
+            self._set_slot_state(slot, _FREE)
+        self._free.release()
+
+    def close (self):
+        """Detach this process from the shared memory.
+
+        All SharedReadBatch objects obtained in this process and any views
+        derived from them have to be released before.
+        """
+        self._shm.close()
+
+    def unlink (self):
+        """Destroy the shared memory block.
+
+        Should be called exactly once, by the process that created the ring,
+        after all processes are done with it.
+        """
+        self._shm.unlink()
+
+
+class SharedReadBatch (object):
+    """Give zero-copy access to the reads of one ReadBatchRing slot.
+
+    The title, sequence and quality of every read are exposed as memoryviews
+    into shared memory through views(), or wrapped in SharedSeqRead
+    facades through indexing or iteration.
+    After release() the slot may be overwritten by the producer at any time.
+    Therefore, release() also releases all memoryviews handed out by the
+    batch, including those of its SharedSeqRead objects, so any later
+    attempt to access them raises ValueError. Views derived from these by
+    the caller, however, cannot be invalidated and must not be used anymore.
+    """
+
+    def __init__ (self, ring, slot, count):
+        self._ring = ring
+        self._slot = slot
+        self._count = count
+        offsets_start = ring._slot_start(slot) + _SLOT_HEADER.size
+        data_start = offsets_start + 4 * (3 * count + 1)
+        self._offsets = ring._shm.buf[offsets_start:data_start].cast('I')
+        self._data = ring._shm.buf[
+            data_start:ring._slot_start(slot) + ring.slot_size
+            ]
+        # all views handed out so far
+        self._views = []
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, *exc_info):
+        self.release()
+
+    def __len__ (self):
+        return self._count
+
+    def views (self, i):
+        """Return (title, sequence, quality) memoryviews of the i-th read."""
+        if not 0 <= i < self._count:
+            raise IndexError('read index out of range')
+        o = self._offsets
+        d = self._data
+        i *= 3
+        views = (
+            d[o[i]:o[i + 1]], d[o[i + 1]:o[i + 2]], d[o[i + 2]:o[i + 3]]
+            )
+        self._views.extend(views)
+        return views
+
+    def __getitem__ (self, i):
+        if i < 0:
+            i += self._count
+        return SharedSeqRead(self.views(i))
+
+    def __iter__ (self):
+        for i in range(self._count):
+            yield SharedSeqRead(self.views(i))
+
+    def release (self):
+        """Return the slot of this batch to the ring."""
+        if self._slot is None:
+            return
+        for view in self._views:
+            view.release()
+        self._views = []
+        self._offsets.release()
+        self._data.release()
+        self._ring._release(self._slot)
+        self._slot = None
+
+
+class SharedSeqRead (SimpleSeqRead):
+    """A SimpleSeqRead working on memoryviews into a SharedReadBatch.
+
+    Fields are copied to bytes only when they are accessed through the
+    SeqReadFacade interface. The underlying memoryviews are available as
+    the read attribute. Reversing or complementing a read copies its fields
+    first so that the shared batch is never modified.
+    """
+
+    @property
+    def sequence (self):
+        return bytes(self.read[1])
+
+    @property
+    def quality (self):
+        return bytes(self.read[2])
+
+    @property
+    def full_title (self):
+        return bytes(self.read[0])
+
+    @property
+    def read_data (self):
+        return bytes(self.read[0]), bytes(self.read[1]), bytes(self.read[2])
+
+    def _detach (self):
+        if isinstance(self.read[1], memoryview):
+            self.read = self.read_data
+
+    def reverse (self):
+        self._detach()
+        super().reverse()
+
+    def complement (self):
+        self._detach()
+        super().complement()
+
+    def reverse_complement (self):
+        self._detach()
+        super().reverse_complement()
+
+    def __len__ (self):
+        return len(self.read[1])